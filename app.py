@@ -1,17 +1,26 @@
 ﻿import os
+import hashlib
+import queue
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
 from dotenv import load_dotenv
 
 # Suppress TensorFlow warnings (set before importing TensorFlow)
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'  # 0=all, 1=info, 2=warnings, 3=errors only
+os.environ.setdefault('TF_ENABLE_ONEDNN_OPTS', '1')  # oneDNN (AVX-512/VNNI) CPU kernels
 
-from flask import Flask, request, render_template, jsonify, redirect, make_response
+from flask import Flask, Response, request, render_template, jsonify, redirect, make_response, stream_with_context
+from flask import session as flask_session
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import RequestEntityTooLarge
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import numpy as np
-from util import base64_to_pil
-from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing import image
-from tensorflow.keras.applications.imagenet_utils import preprocess_input
+from util import MAX_BASE64_LENGTH, InvalidImageError, base64_to_bytes, bytes_to_pil
 
 # -------------------------------------------------------------------
 # Load environment variables
@@ -21,60 +30,369 @@ load_dotenv(dotenv_path=Path(__file__).resolve().parent / '.env')
 # -------------------------------------------------------------------
 # Flask app setup
 # -------------------------------------------------------------------
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson; used by jsonify, get_json and the SSE relay."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__, static_folder='static', static_url_path='/static')
+app.json = ORJSONProvider(app)
 app.secret_key = os.environ.get('SECRET_KEY', 'super-secret-key')
+# Reject oversized bodies before they are read and parsed (base64 limit + JSON envelope)
+app.config['MAX_CONTENT_LENGTH'] = MAX_BASE64_LENGTH + 64 * 1024
 
 app.jinja_env.globals['SUPABASE_URL'] = os.environ.get('SUPABASE_URL', '')
 app.jinja_env.globals['SUPABASE_ANON_KEY'] = os.environ.get('SUPABASE_ANON_KEY', '')
 
-model = None  # Lazy-loaded
+MODEL_PATH = 'models/oldModel.h5'
+TFLITE_MODEL_PATH = 'models/oldModel.tflite'  # Optional, produced by convert_model.py
+
+# The 64x64 model is too small to benefit from fanning out over every core;
+# a couple of intra-op threads avoids thread-pool contention (tune per host).
+TF_INTRA_OP_THREADS = int(os.environ.get('TF_INTRA_OP_THREADS', 2))
+TF_INTER_OP_THREADS = int(os.environ.get('TF_INTER_OP_THREADS', 1))
+
+tf = None  # Imported on first use by _import_tf()
+model = None  # Lazy-loaded (Keras model or TFLite interpreter)
+infer = None  # batch -> predictions, built alongside the model
+pad_batches = False  # Whether infer wants power-of-two batch sizes (XLA path only)
+
+# Inference batching: concurrent /predict calls are coalesced into one forward pass.
+# queue/threading are cooperative once gevent has monkey-patched the process.
+MAX_BATCH = 16
+MAX_WAIT_MS = 10
+
+_predict_queue = queue.Queue()
+_batch_worker = None
+_batch_worker_lock = threading.Lock()
+
+# Repeat uploads of the same image skip decode and inference entirely
+PREDICTION_CACHE_SIZE = 1024
+
+# Repeated Gemini prompts are answered from memory for up to an hour
+GEMINI_CACHE_SIZE = 2048
+GEMINI_CACHE_TTL = 60 * 60
+
+# Pooled keep-alive connections to the Gemini API (skips a TCP+TLS handshake per call)
+_gemini_session = requests.Session()
+_gemini_session.mount('https://', HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=64,
+    # Retry only when the generation never started (connect errors, 429/503);
+    # a read timeout may already be a billed generation, so it is not retried.
+    max_retries=Retry(
+        total=2,
+        read=0,
+        backoff_factor=0.2,
+        status_forcelist=[429, 503],
+        allowed_methods=frozenset({'POST'}),
+        raise_on_status=False,
+    ),
+))
 
 # -------------------------------------------------------------------
 # Helper functions
 # -------------------------------------------------------------------
+class _LRUCache:
+    """Small thread-safe LRU mapping with an optional per-entry TTL (seconds)."""
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+# Diagnoses keyed by the blake2b digest of the uploaded image bytes
+_prediction_cache = _LRUCache(PREDICTION_CACHE_SIZE)
+
+# Gemini (reply, raw) pairs keyed by a hash of (model, message, stream mode).
+# Streamed entries have no raw response, so they are never served as JSON.
+_gemini_cache = _LRUCache(GEMINI_CACHE_SIZE, ttl=GEMINI_CACHE_TTL)
+
+
+def _gemini_cache_key(model_name, user_message, stream):
+    mode = 'stream' if stream else 'json'
+    return hashlib.sha256(f'{mode}\x00{model_name}\x00{user_message}'.encode('utf-8')).digest()
+
+
+def _import_tf():
+    """Import TensorFlow on first use so worker startup doesn't pay for it."""
+    global tf
+    if tf is None:
+        import tensorflow
+        # Must be configured before the TF runtime initializes
+        tensorflow.config.threading.set_intra_op_parallelism_threads(TF_INTRA_OP_THREADS)
+        tensorflow.config.threading.set_inter_op_parallelism_threads(TF_INTER_OP_THREADS)
+        tf = tensorflow
+    return tf
+
+
+def _tflite_infer(interpreter):
+    """Wrap a TFLite interpreter as a uint8 batch -> predictions function.
+
+    The input tensor is allocated once at MAX_BATCH rows and smaller batches
+    are zero-padded, so the interpreter never reallocates between calls.
+    """
+    input_index = interpreter.get_input_details()[0]['index']
+    output_index = interpreter.get_output_details()[0]['index']
+    interpreter.resize_tensor_input(input_index, [MAX_BATCH, 64, 64, 3])
+    interpreter.allocate_tensors()
+    x = np.zeros((MAX_BATCH, 64, 64, 3), dtype=np.float32)
+
+    def run(batch):
+        n = batch.shape[0]
+        # Same scaling as preprocess_input(mode='tf'), written straight into the input buffer
+        np.multiply(batch, 1.0 / 127.5, out=x[:n])
+        np.subtract(x[:n], 1.0, out=x[:n])
+        x[n:] = 0.0
+
+        interpreter.set_tensor(input_index, x)
+        interpreter.invoke()
+        return interpreter.get_tensor(output_index)[:n].copy()
+
+    return run
+
+
+def _load_model():
+    """Load the model once and return (uint8 batch inference function, pad_batches).
+
+    Prefers the quantized TFLite model when present, otherwise compiles the
+    Keras model into an XLA tf.function. Only the XLA function needs batches
+    padded to a power of two; the TFLite wrapper pads into its own buffer.
+    """
+    global model, infer, pad_batches
+    if infer is None:
+        _import_tf()
+        if os.path.exists(TFLITE_MODEL_PATH):
+            loaded = tf.lite.Interpreter(model_path=TFLITE_MODEL_PATH, num_threads=TF_INTRA_OP_THREADS)
+            run = _tflite_infer(loaded)
+            pad = False
+            backend = 'TFLite'
+        else:
+            loaded = tf.keras.models.load_model(MODEL_PATH)
+            # Scaling to [-1, 1] happens inside the graph so XLA can fuse it
+            # with the first convolution
+            forward = tf.function(
+                lambda x: loaded(tf.cast(x, tf.float32) / 127.5 - 1.0, training=False),
+                jit_compile=True,
+            ).get_concrete_function(tf.TensorSpec([None, 64, 64, 3], tf.uint8))
+            run = lambda batch: forward(tf.constant(batch)).numpy()
+            pad = True
+            backend = 'XLA-compiled tf.function'
+
+        # Only publish the model once warm-up succeeds, so a failure is retried
+        _warm_up(run, pad)
+        model, infer, pad_batches = loaded, run, pad
+        print(f'✅ Model loaded successfully ({backend}).')
+    return infer, pad_batches
+
+
+def _padded_size(n):
+    """Round a batch size up to a power of two so XLA only compiles a few shapes."""
+    size = 1
+    while size < n:
+        size *= 2
+    return size
+
+
+def _warm_up(run, pad):
+    """Run dummy batches so compilation happens before real traffic.
+
+    With padding, every padded size gets its own XLA compilation; otherwise
+    the input shape is fixed and a single call is enough.
+    """
+    size = 1
+    while size <= (_padded_size(MAX_BATCH) if pad else 1):
+        run(np.zeros((size, 64, 64, 3), dtype=np.uint8))
+        size *= 2
+
+
+def _run_batch(batch):
+    run, pad = _load_model()
+    n = batch.shape[0]
+    size = _padded_size(n) if pad else n
+    if size != n:
+        padding = np.zeros((size - n,) + batch.shape[1:], dtype=batch.dtype)
+        batch = np.concatenate([batch, padding], axis=0)
+    return run(batch)[:n]
+
+
+def _batch_loop():
+    """Drain the predict queue and run one model call per batch."""
+    try:
+        _load_model()
+    except Exception as e:
+        # Requests will retry the load and receive the error themselves
+        print(f"[ERROR] Model warm-up failed: {e}")
+
+    while True:
+        items = [_predict_queue.get()]
+        deadline = time.monotonic() + MAX_WAIT_MS / 1000.0
+        while len(items) < MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(_predict_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        try:
+            batch = np.concatenate([x for x, _, _ in items], axis=0)
+            preds = _run_batch(batch)
+            for i, (_, _, holder) in enumerate(items):
+                holder['preds'] = preds[i:i + 1]
+        except Exception as e:
+            for _, _, holder in items:
+                holder['error'] = e
+        finally:
+            for _, done, _ in items:
+                done.set()
+
+
+def _ensure_batch_worker():
+    global _batch_worker
+    # is_alive() also catches a thread object inherited across a fork
+    if _batch_worker is None or not _batch_worker.is_alive():
+        with _batch_worker_lock:
+            if _batch_worker is None or not _batch_worker.is_alive():
+                _batch_worker = threading.Thread(target=_batch_loop, name='predict-batcher', daemon=True)
+                _batch_worker.start()
+
+
 def model_predict(img):
-    """Run prediction directly with TensorFlow 2 eager execution."""
-    x = image.img_to_array(img)
-    x = np.expand_dims(x, axis=0)
-    x = preprocess_input(x, mode='tf')
-    global model
-    if model is None:
-        model = load_model('models/oldModel.h5')
-        print('✅ Model loaded successfully (TF 2.x eager mode).')
-    preds = model.predict(x)
-    return preds
+    """Queue a prediction and wait for the batch worker to run it."""
+    # Raw uint8 pixels; scaling is done by the inference function
+    x = np.asarray(img, dtype=np.uint8)[np.newaxis]
+
+    _ensure_batch_worker()
+    done = threading.Event()
+    holder = {}
+    _predict_queue.put((x, done, holder))
+    done.wait()
+
+    if 'error' in holder:
+        raise holder['error']
+    return holder['preds']
+
+
+def start_model_warmup():
+    """Start the batching worker, which loads and warms up the model in the background.
+
+    Called per serving process (gunicorn post_worker_init, or the dev server's
+    reloader child) rather than at import, so a pre-fork parent never starts
+    TensorFlow. Without it the model loads on the first /predict.
+    """
+    _ensure_batch_worker()
+
+
+def _sse_event(payload):
+    return f'data: {app.json.dumps(payload)}\n\n'
+
+
+def _sse_response(events):
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+def _relay_gemini_stream(r, cache_key):
+    """Forward Gemini SSE chunks to the browser as {"text": ...} events."""
+    parts = []
+    try:
+        for line in r.iter_lines():
+            if not line.startswith(b'data:'):
+                continue
+            chunk = app.json.loads(line[5:])
+            try:
+                text = chunk['candidates'][0]['content']['parts'][0]['text']
+            except (KeyError, IndexError):
+                continue
+            parts.append(text)
+            yield _sse_event({'text': text})
+
+        if parts:
+            # Streamed replies have no single raw response to keep
+            _gemini_cache.set(cache_key, (''.join(parts), None))
+        yield _sse_event({'done': True})
+    except requests.RequestException as e:
+        print(f'[Gemini API] Stream interrupted: {e}')
+        yield _sse_event({'error': 'gemini request failed', 'detail': str(e)})
+    except ValueError as e:
+        print(f'[Gemini API] Malformed stream chunk: {e}')
+        yield _sse_event({'error': 'invalid response from gemini', 'detail': str(e)})
+    finally:
+        r.close()
+
+
+def _render_cached(template, cache_control):
+    """Render a template with Cache-Control and an ETag so repeat visits can 304."""
+    resp = make_response(render_template(template))
+    resp.headers['Cache-Control'] = cache_control
+    resp.set_etag(hashlib.md5(resp.get_data(), usedforsecurity=False).hexdigest())
+    return resp.make_conditional(request)
 
 
 def _is_authenticated(req):
+    # Check the Supabase cookie first; it avoids decoding and verifying the
+    # signed Flask session cookie on the common path.
+    token = req.cookies.get('sb-access-token')
+    if token:
+        return True
     try:
-        from flask import session as flask_session
-        if flask_session.get('user'):
-            return True
+        return bool(flask_session.get('user'))
     except Exception:
-        pass
-    token = req.cookies.get('sb-access-token')
-    return token is not None and len(token) > 0
+        return False
 
 # -------------------------------------------------------------------
 # Routes
 # -------------------------------------------------------------------
 @app.route('/', methods=['GET'])
 def index():
-    return render_template('index.html')
+    return _render_cached('index.html', 'public, max-age=300')
 
 
 @app.route('/auth', methods=['GET'])
 def auth_page():
     if _is_authenticated(request):
         return redirect('/dashboard')
-    return render_template('auth.html')
+    # Revalidate every time: the same URL redirects once the user signs in
+    return _render_cached('auth.html', 'private, max-age=0, must-revalidate')
 
 
 @app.route('/dashboard', methods=['GET'])
 def dashboard():
     if not _is_authenticated(request):
         return redirect('/')
-    return render_template('dashboard.html')
+    return _render_cached('dashboard.html', 'private, max-age=0, must-revalidate')
 
 
 @app.route('/session', methods=['POST'])
@@ -85,7 +403,6 @@ def create_session():
         return jsonify(error='missing access_token'), 400
 
     try:
-        from flask import session as flask_session
         flask_session['user'] = True
     except Exception:
         pass
@@ -106,7 +423,6 @@ def create_session():
 @app.route('/logout', methods=['POST', 'GET'])
 def logout():
     try:
-        from flask import session as flask_session
         flask_session.clear()
     except Exception:
         pass
@@ -126,23 +442,30 @@ def predict():
     if not _is_authenticated(request):
         return jsonify(error='unauthorized'), 401
 
-    try:
-        img = base64_to_pil(request.json)
-        uploads_dir = Path(__file__).resolve().parent / 'uploads'
-        uploads_dir.mkdir(exist_ok=True)
-
-        img_path = uploads_dir / 'image.jpg'
-        img.save(img_path)
+    # Outside the try so an oversized body surfaces as 413 rather than a 500
+    payload = request.get_json(silent=True)
 
-        img = image.load_img(img_path, target_size=(64, 64))
+    try:
+        raw = base64_to_bytes(payload)
+        digest = hashlib.blake2b(raw, digest_size=16).digest()
+        diagnosis = _prediction_cache.get(digest)
+        if diagnosis is not None:
+            print(f"[INFO] Prediction cache hit: {diagnosis}")
+            return jsonify(result=diagnosis)
+
+        img = bytes_to_pil(raw, target_size=(64, 64))
         # Model is loaded lazily inside model_predict
         preds = model_predict(img)
         result = preds[0, 0]
 
         diagnosis = "PNEUMONIA" if result > 0.5 else "NORMAL"
         print(f"[INFO] Prediction result: {diagnosis} ({result})")
+        _prediction_cache.set(digest, diagnosis)
 
         return jsonify(result=diagnosis)
+    except InvalidImageError as e:
+        print(f"[ERROR] Rejected upload: {e}")
+        return jsonify(error=str(e)), 400
     except Exception as e:
         print(f"[ERROR] Prediction failed: {e}")
         return jsonify(error=str(e)), 500
@@ -150,13 +473,17 @@ def predict():
 
 @app.route('/gemini', methods=['POST'])
 def gemini_proxy():
-    """Proxy for Gemini API."""
+    """Proxy for Gemini API.
+
+    With {"stream": true} the reply is relayed as Server-Sent Events.
+    """
     if not _is_authenticated(request):
         return jsonify(error='unauthorized'), 401
 
     payload = request.get_json(silent=True) or {}
     user_message = payload.get('message', '')
     model_name = payload.get('model', 'gemini-1.5-flash')
+    stream = bool(payload.get('stream'))
 
     if not user_message:
         return jsonify(error='message is required'), 400
@@ -165,15 +492,25 @@ def gemini_proxy():
     if not api_key:
         return jsonify(error='server not configured: GEMINI_API_KEY missing'), 500
 
+    cache_key = _gemini_cache_key(model_name, user_message, stream)
+    cached = _gemini_cache.get(cache_key)
+    if cached is not None:
+        text, data = cached
+        if stream:
+            return _sse_response(iter([_sse_event({'text': text}), _sse_event({'done': True})]))
+        return jsonify(reply=text, raw=data)
+
     try:
-        url = f'https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent'
+        method = 'streamGenerateContent' if stream else 'generateContent'
+        url = f'https://generativelanguage.googleapis.com/v1beta/models/{model_name}:{method}'
         headers = {
             'Content-Type': 'application/json',
             'X-goog-api-key': api_key
         }
         body = {'contents': [{'parts': [{'text': user_message}]}]}
 
-        r = requests.post(url, headers=headers, json=body, timeout=30)
+        params = {'alt': 'sse'} if stream else None
+        r = _gemini_session.post(url, headers=headers, json=body, params=params, stream=stream, timeout=30)
         
         # Check for HTTP errors
         if not r.ok:
@@ -181,7 +518,10 @@ def gemini_proxy():
             error_msg = error_data.get('error', {}).get('message', f'HTTP {r.status_code}: {r.text}')
             print(f'[Gemini API Error] Status: {r.status_code}, Response: {r.text}')
             return jsonify(error=error_msg, detail=error_data), 502
-        
+
+        if stream:
+            return _sse_response(_relay_gemini_stream(r, cache_key))
+
         data = r.json()
 
         text = ''
@@ -192,6 +532,8 @@ def gemini_proxy():
             print(f'[Gemini API] Response data: {data}')
             text = ''
 
+        if text:
+            _gemini_cache.set(cache_key, (text, data))
         return jsonify(reply=text, raw=data)
     except requests.RequestException as e:
         print(f'[Gemini API] Request exception: {e}')
@@ -201,9 +543,17 @@ def gemini_proxy():
         return jsonify(error='unexpected error', detail=str(e)), 500
 
 
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    return jsonify(error='request too large'), 413
+
+
 # -------------------------------------------------------------------
 # Run Flask app
 # -------------------------------------------------------------------
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5002))
+    # With debug=True only the reloader's child process serves requests
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_model_warmup()
     app.run(port=port, debug=True, threaded=True)
@@ -0,0 +1,37 @@
+"""Convert the Keras model to a quantized TFLite model for CPU inference.
+
+Usage:
+    python convert_model.py            # FP16 weights (default)
+    python convert_model.py --int8     # INT8 dynamic-range weights
+
+app.py picks up models/oldModel.tflite automatically when it exists.
+"""
+import argparse
+import os
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+import tensorflow as tf
+from tensorflow.keras.models import load_model
+
+
+def convert(src, dst, int8=False):
+    model = load_model(src)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if not int8:
+        converter.target_spec.supported_types = [tf.float16]
+
+    tflite_model = converter.convert()
+    with open(dst, 'wb') as f:
+        f.write(tflite_model)
+    print(f'✅ Wrote {dst} ({len(tflite_model) / 1024:.1f} KiB)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--src', default='models/oldModel.h5')
+    parser.add_argument('--dst', default='models/oldModel.tflite')
+    parser.add_argument('--int8', action='store_true', help='use INT8 dynamic-range quantization instead of FP16')
+    args = parser.parse_args()
+    convert(args.src, args.dst, int8=args.int8)
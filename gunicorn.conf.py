@@ -0,0 +1,24 @@
+"""gunicorn settings, picked up automatically from the working directory.
+
+/gemini spends most of its time waiting on Google, so the default worker
+class is gevent: each process keeps many upstream calls in flight on
+greenlets instead of one sync worker being blocked per call. Flags given
+on the command line (e.g. -k, -w) take precedence over these values.
+
+The worker count is left to gunicorn (WEB_CONCURRENCY, else 1): every
+worker loads its own TensorFlow runtime and model, so scale it to the
+instance's memory.
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5002')}"
+worker_class = 'gevent'
+worker_connections = 1000
+timeout = 120
+
+
+def post_worker_init(worker):
+    # Load and warm up the model in each worker, after the fork: TensorFlow
+    # is not fork-safe, so it must never start in the (possibly --preload) master.
+    from app import start_model_warmup
+    start_model_warmup()
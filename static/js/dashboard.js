@@ -53,14 +53,15 @@
       return { valid: false, error: 'No file selected' };
     }
 
-    if (!file.type.startsWith('image/')) {
-      return { valid: false, error: 'Please upload an image file (JPG, PNG, etc.)' };
+    // Server accepts JPEG/PNG only
+    if (file.type !== 'image/jpeg' && file.type !== 'image/png') {
+      return { valid: false, error: 'Please upload a JPG or PNG image' };
     }
 
-    // Check file size (max 10MB)
-    const maxSize = 10 * 1024 * 1024; // 10MB
+    // Check file size (max 6MB; the base64 upload must stay under the server's 8 MiB limit)
+    const maxSize = 6000000; // 6MB
     if (file.size > maxSize) {
-      return { valid: false, error: 'File size exceeds 10MB limit' };
+      return { valid: false, error: 'File size exceeds 6MB limit' };
     }
 
     return { valid: true };
@@ -546,7 +547,17 @@
     function addMessage(role, text) {
       const msgDiv = document.createElement('div');
       msgDiv.className = `chat-msg ${role}`;
-      
+      setMessageContent(msgDiv, role, text);
+
+      chat.appendChild(msgDiv);
+      scrollChatToBottom();
+      return msgDiv;
+    }
+
+    /**
+     * Set message content
+     */
+    function setMessageContent(msgDiv, role, text) {
       // Render markdown for assistant messages, plain text for user messages
       if (role === 'assistant' && typeof marked !== 'undefined') {
         // Use marked.js to render markdown
@@ -555,9 +566,34 @@
         // Use textContent for user messages to prevent XSS
         msgDiv.textContent = text;
       }
-      
-      chat.appendChild(msgDiv);
-      scrollChatToBottom();
+    }
+
+    /**
+     * Read a text/event-stream response, calling onEvent with each JSON `data:` payload
+     */
+    async function readEventStream(response, onEvent) {
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+          const rawEvent = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+
+          const data = rawEvent
+            .split('\n')
+            .filter((line) => line.startsWith('data:'))
+            .map((line) => line.slice(5).trim())
+            .join('\n');
+          if (data) onEvent(JSON.parse(data));
+        }
+      }
     }
 
     /**
@@ -599,6 +635,7 @@
           body: JSON.stringify({
             message: message,
             model: 'gemini-2.0-flash',
+            stream: true,
           }),
         });
 
@@ -609,14 +646,32 @@
           throw new Error(`${errorMsg}${errorDetail}`);
         }
 
-        const data = await response.json();
-        const reply = data.reply || 'Sorry, I could not generate a response.';
+        // Render the reply as chunks arrive
+        let reply = '';
+        let replyDiv = null;
+        let streamError = null;
 
-        // Remove typing indicator
-        typingIndicator.remove();
+        await readEventStream(response, (event) => {
+          if (event.error) {
+            streamError = event.detail ? `${event.error} (${event.detail})` : event.error;
+            return;
+          }
+          if (!event.text) return;
+
+          reply += event.text;
+          if (!replyDiv) {
+            // Remove typing indicator
+            typingIndicator.remove();
+            replyDiv = addMessage('assistant', reply);
+          } else {
+            setMessageContent(replyDiv, 'assistant', reply);
+            scrollChatToBottom();
+          }
+        });
 
-        // Add assistant reply
-        addMessage('assistant', reply);
+        typingIndicator.remove();
+        if (streamError) throw new Error(streamError);
+        if (!replyDiv) addMessage('assistant', 'Sorry, I could not generate a response.');
 
       } catch (error) {
         typingIndicator.remove();
@@ -52,14 +52,14 @@ function handleFileSelect(file) {
     if (!file) return;
     
     // Validate file type
-    if (!file.type.match('image.*')) {
-        alert('Please select a valid image file.');
+    if (file.type !== 'image/jpeg' && file.type !== 'image/png') {
+        alert('Please select a JPG or PNG image.');
         return;
     }
     
-    // Validate file size (max 10MB)
-    if (file.size > 10 * 1024 * 1024) {
-        alert('File size too large. Please select an image smaller than 10MB.');
+    // Validate file size (max 6MB; the base64 upload must stay under the server's 8 MiB limit)
+    if (file.size > 6000000) {
+        alert('File size too large. Please select an image smaller than 6MB.');
         return;
     }
     
@@ -1,21 +1,32 @@
 """Utilities for image conversion and processing."""
-import re
-import base64
+import pybase64
 import numpy as np
 from PIL import Image
 from io import BytesIO
 
+# Uploads above this many base64 characters (~6 MB of image data) are rejected before decoding
+MAX_BASE64_LENGTH = 8 * 1024 * 1024
+ALLOWED_FORMATS = ("JPEG", "PNG")
+ALLOWED_DATA_URI_HEADERS = ("data:image/jpeg;base64", "data:image/jpg;base64", "data:image/png;base64")
 
-def base64_to_pil(data):
+# Refuse decompression bombs (tiny files that expand to huge pixel buffers)
+Image.MAX_IMAGE_PIXELS = 32_000_000
+
+
+class InvalidImageError(ValueError):
+    """Raised when uploaded image data is missing, malformed, too large or of an unsupported type."""
+
+
+def base64_to_bytes(data):
     """
-    Convert base64-encoded image data (string or JSON) to a PIL image.
+    Decode base64-encoded image data (string or JSON) to raw image bytes.
 
     Accepts:
       - raw base64 string
       - JSON object like { "image": "<data>" }
 
     Returns:
-      PIL.Image.Image
+      bytes
     """
     if isinstance(data, dict):
         # If the incoming JSON has an "image" key
@@ -24,19 +35,63 @@ def base64_to_pil(data):
         img_base64 = data or ""
 
     if not isinstance(img_base64, str) or not img_base64.strip():
-        raise ValueError("Invalid base64 input: must be a non-empty string")
+        raise InvalidImageError("Invalid base64 input: must be a non-empty string")
+
+    if len(img_base64) > MAX_BASE64_LENGTH:
+        raise InvalidImageError("Image too large: limit is 8 MB of base64 data")
 
     # Remove the header (e.g. data:image/jpeg;base64,)
-    image_data = re.sub(r'^data:image\/[a-zA-Z]+;base64,', '', img_base64)
+    image_data = img_base64
+    if image_data.startswith("data:"):
+        header, _, image_data = image_data.partition(",")
+        if header.lower() not in ALLOWED_DATA_URI_HEADERS:
+            raise InvalidImageError("Unsupported image type: only JPEG and PNG are accepted")
+
+    try:
+        return pybase64.b64decode(image_data)
+    except Exception as e:
+        raise InvalidImageError(f"Failed to decode base64 image: {e}")
+
+
+def bytes_to_pil(raw, target_size=None):
+    """
+    Open raw image bytes as an RGB PIL image.
 
+    If target_size (width, height) is given, the image is resized in memory
+    before returning.
+    """
     try:
-        pil_image = Image.open(BytesIO(base64.b64decode(image_data))).convert("RGB")
+        pil_image = Image.open(BytesIO(raw), formats=ALLOWED_FORMATS)
     except Exception as e:
-        raise ValueError(f"Failed to decode base64 image: {e}")
+        raise InvalidImageError(f"Failed to decode base64 image: {e}")
+
+    # Image.open only reads the header; refuse before allocating pixels
+    if pil_image.width * pil_image.height > Image.MAX_IMAGE_PIXELS:
+        raise InvalidImageError(f"Image too large: {pil_image.width}x{pil_image.height} pixels")
 
+    try:
+        if target_size is not None:
+            # JPEG only: let libjpeg-turbo downscale during decode (DCT scaling)
+            pil_image.draft("RGB", target_size)
+        pil_image = pil_image.convert("RGB")
+    except Exception as e:
+        raise InvalidImageError(f"Failed to decode base64 image: {e}")
+
+    if target_size is not None:
+        pil_image = pil_image.resize(target_size, Image.BILINEAR)
     return pil_image
 
 
+def base64_to_pil(data, target_size=None):
+    """
+    Convert base64-encoded image data (string or JSON) to a PIL image.
+
+    Returns:
+      PIL.Image.Image
+    """
+    return bytes_to_pil(base64_to_bytes(data), target_size=target_size)
+
+
 def np_to_base64(img_np):
     """
     Convert numpy RGB image to base64-encoded PNG string.
@@ -47,4 +102,4 @@ def np_to_base64(img_np):
     img = Image.fromarray(img_np.astype('uint8'), 'RGB')
     buffered = BytesIO()
     img.save(buffered, format="PNG")
-    return "data:image/png;base64," + base64.b64encode(buffered.getvalue()).decode("ascii")
+    return "data:image/png;base64," + pybase64.b64encode(buffered.getvalue()).decode("ascii")
@@ -0,0 +1,12 @@
+"""WSGI entry point for gunicorn with gevent workers.
+
+    gunicorn -w ${WEB_CONCURRENCY:-1} -k gevent --worker-connections 1000 -b 0.0.0.0:5002 wsgi:app
+
+gevent must patch the stdlib before requests/TensorFlow are imported, so
+this module patches first and only then imports the Flask app.
+"""
+from gevent import monkey
+
+monkey.patch_all()
+
+from app import app  # noqa: E402,F401